@@ -2,119 +2,557 @@ import streamlit as st
 import boto3
 import pandas as pd
 from io import BytesIO
-from datetime import datetime
-import pytz
+from datetime import date, datetime
+from zoneinfo import ZoneInfo
+import openpyxl
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+from openpyxl.cell.cell import ERROR_CODES
+try:
+    from python_calamine import CalamineWorkbook
+except ImportError:  # lector opcional: sin él se usa openpyxl
+    CalamineWorkbook = None
 import re
+import gzip
+import hashlib
+import tempfile
+import os
+import codecs
+import json
+import uuid
+import threading
+import time
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from collections import OrderedDict
 from config import cargar_configuracion
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError
 from pandas.errors import EmptyDataError
 
+logger = logging.getLogger(__name__)
+
 APP_VERSION = "udig-fix-2026-02-25-01"
 
+ARGENTINA_TZ = ZoneInfo("America/Argentina/Buenos_Aires")
+
+# Formato de archivo de los tableros limpios en S3: "parquet" o "csv" (consumidores legacy)
+ARCHIVE_FORMAT = "parquet"
+
+_ARCHIVE_EXTENSIONS = {
+    "parquet": "parquet",
+    "csv": "csv.gz",
+}
+_ARCHIVE_CONTENT_TYPES = {
+    "parquet": "application/x-parquet",
+    "csv": "application/gzip",
+}
+
+# Expresiones regulares compiladas una sola vez al importar
+_FILENAME_RE = re.compile(r"^\d{2}-\d{2}-\d{4}\+.+\+.+\.xlsx$")
+_CUIL_RE = re.compile(r"^\d{11}$")
+_DDMMYYYY_RE = re.compile(r"(0[1-9]|1\d|2[0-8])-(0[1-9]|1[0-2])-(?!0000)\d{4}")  # el resto lo valida strptime
+_OBJETIVO_RE = re.compile(r"-?\d+(\.\d+)?\s*%?")  # se aplica con fullmatch sobre el texto sin espacios en los extremos
+
 # Cargar configuración
 aws_access_key, aws_secret_key, region_name, bucket_name, valid_user, valid_password = cargar_configuracion()
 
 # Configuración de AWS S3
+# Un único cliente para todo el proceso (es thread-safe), con pool de conexiones
+# amplio para sesiones concurrentes y reintentos adaptativos
+_S3_CFG = Config(
+    max_pool_connections=50,
+    retries={"mode": "adaptive", "max_attempts": 10},
+    tcp_keepalive=True,
+    s3={"addressing_style": "virtual"}
+)
 s3 = boto3.client(
     's3',
     aws_access_key_id=aws_access_key,
     aws_secret_access_key=aws_secret_key,
-    region_name=region_name
+    region_name=region_name,
+    config=_S3_CFG
+)
+
+# Subidas multipart en paralelo cuando el archivo supera el umbral
+_TRANSFER_CFG = TransferConfig(
+    multipart_threshold=8 * 1024 ** 2,
+    multipart_chunksize=50 * 1024 ** 2,
+    max_concurrency=10,
+    use_threads=True
+)
+
+# Subidas en streaming (desde un pipe): partes chicas para acotar la memoria en vuelo
+_STREAM_TRANSFER_CFG = TransferConfig(
+    multipart_threshold=8 * 1024 ** 2,
+    multipart_chunksize=8 * 1024 ** 2,
+    max_concurrency=8,
+    use_threads=True
 )
 
 # Key helper para el índice por período
 def _get_period_index_key(periodo_str):
     """
     Devuelve la key S3 del índice del período dentro de la carpeta del mes.
+    Ejemplo: periodo_str = '01-10-2025' -> '01-10-2025/indice.parquet'
+    """
+    return f"{periodo_str}/indice.parquet"
+
+def _get_legacy_period_index_key(periodo_str):
+    """
+    Key del índice en el formato anterior (CSV), antes de pasar a Parquet.
     Ejemplo: periodo_str = '01-10-2025' -> '01-10-2025/indice.csv'
     """
     return f"{periodo_str}/indice.csv"
 
-def _load_period_index(periodo_str):
+def _normalize_period_index(df):
     """
-    Lee el índice del período (Periodo/indice.csv).
-    Si no existe o está vacío, devuelve un DataFrame vacío con columnas estándar.
+    Deja el índice con las columnas estándar (Periodo, CUIL, Lider) y el CUIL como texto.
+    """
+    expected = ["Periodo", "CUIL", "Lider"]
+    for col in expected:
+        if col not in df.columns:
+            df[col] = None
+    df = df[expected]
+    if not df.empty:
+        df = df.assign(CUIL=df["CUIL"].astype(str))
+    return df
+
+def _load_legacy_period_index(periodo_str):
+    """
+    Lee el índice CSV anterior ('<Periodo>/indice.csv').
+    Se usa solo mientras el período no tenga índice Parquet; el próximo
+    guardado lo escribe en Parquet (y sigue actualizando el CSV para app_v1).
     """
-    key = _get_period_index_key(periodo_str)
     try:
-        obj = s3.get_object(Bucket=bucket_name, Key=key)
+        obj = s3.get_object(Bucket=bucket_name, Key=_get_legacy_period_index_key(periodo_str))
         try:
-            df = pd.read_csv(BytesIO(obj["Body"].read()), dtype={"CUIL": str})
+            return pd.read_csv(BytesIO(obj["Body"].read()), dtype={"CUIL": str})
         except EmptyDataError:
             return pd.DataFrame(columns=["Periodo", "CUIL", "Lider"])
-
-        expected = ["Periodo", "CUIL", "Lider"]
-        for col in expected:
-            if col not in df.columns:
-                df[col] = None
-        df = df[expected]
-        return df
     except ClientError as e:
         code = e.response.get("Error", {}).get("Code")
         if code in ("NoSuchKey", "404", "NoSuchBucket"):
             return pd.DataFrame(columns=["Periodo", "CUIL", "Lider"])
         raise
 
+# Cache LRU en memoria del índice por período: (bucket, key) -> (etag, DataFrame).
+# Se consulta desde varios hilos (sesiones y guardado del índice), por eso el lock.
+_INDEX_CACHE = OrderedDict()
+_INDEX_CACHE_MAX = 32
+_INDEX_CACHE_LOCK = threading.Lock()
+
+def _index_cache_get(cache_key):
+    with _INDEX_CACHE_LOCK:
+        cached = _INDEX_CACHE.get(cache_key)
+        if cached is not None:
+            _INDEX_CACHE.move_to_end(cache_key)
+        return cached
+
+def _index_cache_put(cache_key, value):
+    with _INDEX_CACHE_LOCK:
+        _INDEX_CACHE[cache_key] = value
+        _INDEX_CACHE.move_to_end(cache_key)
+        while len(_INDEX_CACHE) > _INDEX_CACHE_MAX:
+            _INDEX_CACHE.popitem(last=False)  # el período usado hace más tiempo
+
+def _index_cache_discard(cache_key):
+    with _INDEX_CACHE_LOCK:
+        _INDEX_CACHE.pop(cache_key, None)
+
+def _load_period_index(periodo_str):
+    """
+    Lee el índice del período (Periodo/indice.parquet).
+    Si no existe, intenta con el índice CSV anterior; si tampoco existe,
+    devuelve un DataFrame vacío con columnas estándar.
+    Si el índice ya está en cache, se pide a S3 solo si cambió (ETag); si no
+    cambió, se devuelve la copia en memoria sin volver a descargarlo.
+    """
+    key = _get_period_index_key(periodo_str)
+    cache_key = (bucket_name, key)
+    cached = _index_cache_get(cache_key)
+    try:
+        if cached is not None:
+            obj = s3.get_object(Bucket=bucket_name, Key=key, IfNoneMatch=cached[0])
+        else:
+            obj = s3.get_object(Bucket=bucket_name, Key=key)
+        df = _normalize_period_index(pd.read_parquet(BytesIO(obj["Body"].read())))
+        _index_cache_put(cache_key, (obj["ETag"], df))
+        return df.copy()
+    except ClientError as e:
+        code = e.response.get("Error", {}).get("Code")
+        status = e.response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+        if cached is not None and (code == "304" or status == 304):
+            return cached[1].copy()  # no cambió desde la última lectura
+        if code in ("NoSuchKey", "404", "NoSuchBucket"):
+            _index_cache_discard(cache_key)
+            return _normalize_period_index(_load_legacy_period_index(periodo_str))
+        raise
+
 def _save_period_index(df, periodo_str):
     """
-    Guarda el DataFrame del índice en '<Periodo>/indice.csv'.
+    Guarda el DataFrame del índice en '<Periodo>/indice.parquet' (comprimido con zstd).
+    Invalida la cache: upload_fileobj no devuelve el ETag del objeto nuevo.
+    Mientras v1 siga siendo una versión elegible en app.py, también se guarda
+    '<Periodo>/indice.csv', que es el índice que lee y escribe app_v1.
     """
     key = _get_period_index_key(periodo_str)
+    parquet_buffer = BytesIO()
+    df.to_parquet(parquet_buffer, index=False, compression="zstd")
+    parquet_buffer.seek(0)
+    s3.upload_fileobj(parquet_buffer, bucket_name, key, Config=_TRANSFER_CFG)
+    _index_cache_discard((bucket_name, key))
+
     csv_buffer = BytesIO()
     df.to_csv(csv_buffer, index=False, encoding="utf-8-sig")
     csv_buffer.seek(0)
-    s3.put_object(Bucket=bucket_name, Key=key, Body=csv_buffer.getvalue())
+    s3.upload_fileobj(csv_buffer, bucket_name, _get_legacy_period_index_key(periodo_str), Config=_TRANSFER_CFG)
+
+class _IndexBatch:
+    """Altas al índice de un período pendientes de guardar, y las subidas que las esperan."""
+
+    def __init__(self):
+        self.altas = {}  # CUIL -> líder
+        self.subidas = {}  # Future de cada subida incluida en el lote -> (CUILs, líder)
+        self.intentos = 0
+        self.proximo_intento = 0.0  # time.monotonic()
+
+    def agregar(self, future, cuils, leader_name):
+        self.subidas[future] = (cuils, leader_name)
+        for c in cuils:
+            self.altas.setdefault(c, leader_name)
+
+    def quitar(self, future):
+        """Saca las altas de una subida; las demás conservan su orden de llegada."""
+        del self.subidas[future]
+        self.altas = {}
+        for cuils, leader_name in self.subidas.values():
+            for c in cuils:
+                self.altas.setdefault(c, leader_name)
+
+# Un hilo en segundo plano junta las altas y las guarda cada _INDEX_FLUSH_SECONDS.
+_PENDING_INDEX = {}  # periodo -> _IndexBatch esperando el próximo guardado
+_FLUSHING_INDEX = {}  # periodo -> _IndexBatch guardándose ahora
+_PENDING_INDEX_LOCK = threading.Lock()
+_INDEX_FLUSH_SECONDS = 0.5
+_INDEX_MAX_ATTEMPTS = 5
+_INDEX_RETRY_MAX_SECONDS = 8
+# Cuánto espera una subida a que su lote quede guardado. Cubre las esperas entre
+# intentos (~15 s) y varios intentos lentos; si igual se vence, la subida retira
+# sus altas del lote (ver _withdraw_index_upload) antes de borrar el tablero.
+_INDEX_WAIT_SECONDS = 120
+_index_flusher = None
 
 # Función para cargar un archivo en S3
-def upload_file_to_s3(file, filename, original_filename):
+def upload_file_to_s3(file, filename, content_type=None):
     try:
-        s3.upload_fileobj(file, bucket_name, filename)
-        st.success(f"Archivo '{original_filename}' subido exitosamente.")
+        extra_args = {"ContentType": content_type} if content_type else None
+        s3.upload_fileobj(file, bucket_name, filename, ExtraArgs=extra_args)
         return True
     except Exception as e:
         st.error(f"Error al subir el archivo: {e}")
         return False
 
-# Función para guardar errores en un archivo log en S3
-def log_error_to_s3(error_message, filename):
+# Tipos (según pd.api.types.infer_dtype) de columnas object que pyarrow convierte sin problema
+_ARROW_SAFE_INFERRED = {"string", "empty", "integer", "floating", "mixed-integer-float", "boolean"}
+
+# Función para convertir el tablero limpio a una tabla Arrow
+def _dataframe_to_arrow(df, para_csv=False):
+    """
+    Convierte el DataFrame a una tabla Arrow columna por columna, en una sola
+    pasada y sin DataFrames intermedios; la tabla se escribe directo como CSV o Parquet.
+    - Columnas object que solo tienen números pasan a dtype numérico (Arrow las toma
+      sin copiar); los enteros con vacíos (por ejemplo K1 en blanco en alguna hoja)
+      quedan enteros (Int64), no float. Las que mezclan números y textos (por ejemplo
+      'Resultado') pasan a texto, con el mismo texto que escribiría to_csv.
+      Lo mismo con las categorías.
+    - Con para_csv, las columnas que mezclan enteros y decimales (por ejemplo
+      '% Logro') pasan a texto celda por celda ('100' y '0.95', como to_csv) y las
+      fechas se formatean como en to_csv ('aaaa-mm-dd' si no tienen hora).
+    """
+    arrays = []
+    for col in df.columns:
+        serie = df[col]
+        if serie.dtype == object:
+            tipo = pd.api.types.infer_dtype(serie, skipna=True)
+            if tipo == "integer":
+                serie = serie.astype("Int64")
+            elif tipo not in _ARROW_SAFE_INFERRED or (para_csv and tipo == "mixed-integer-float"):
+                serie = serie.astype("string")
+            else:
+                serie = serie.infer_objects()
+        elif isinstance(serie.dtype, pd.CategoricalDtype):
+            # Una hoja puede traer el CUIL (u otro dato del formulario) como número y otra
+            # como texto: las categorías quedan mezcladas y Arrow no las puede convertir
+            if pd.api.types.infer_dtype(serie.cat.categories, skipna=True) not in _ARROW_SAFE_INFERRED:
+                serie = serie.astype("string")
+        elif para_csv and pd.api.types.is_datetime64_any_dtype(serie):
+            serie = serie.astype(str)
+        arrays.append(pa.Array.from_pandas(serie))
+    return pa.Table.from_arrays(arrays, names=[str(col) for col in df.columns])
+
+# Filas por bloque al escribir el CSV
+_CSV_CHUNK_ROWS = 50_000
+
+# Caracteres que obligan a encerrar un campo entre comillas (como el QUOTE_MINIMAL de to_csv)
+_CSV_QUOTE_CHARS = r'[",\r\n]'
+
+def _csv_needs_quotes(table):
+    """True si algún nombre de columna o valor de texto de la tabla necesita comillas."""
+    if any(re.search(_CSV_QUOTE_CHARS, name) for name in table.column_names):
+        return True
+    for column in table.columns:
+        for chunk in column.chunks:
+            valores = chunk.dictionary if pa.types.is_dictionary(chunk.type) else chunk
+            if not (pa.types.is_string(valores.type) or pa.types.is_large_string(valores.type)):
+                continue
+            if pc.any(pc.match_substring_regex(valores, _CSV_QUOTE_CHARS)).as_py():
+                return True
+    return False
+
+def _format_like_pandas(table):
+    """
+    Pasa a texto las columnas que Arrow escribe distinto que pandas.to_csv:
+    floats enteros ('1.0', Arrow escribe '1') y booleanos ('True'/'False').
+    """
+    for i, field in enumerate(table.schema):
+        column = table.column(i)
+        if pa.types.is_floating(field.type):
+            # Python (y pandas) usa notación exponencial desde 1e16
+            entero = pc.and_(pc.equal(column, pc.floor(column)), pc.less(pc.abs(column), 1e16))
+            como_entero = pc.cast(pc.cast(pc.if_else(entero, column, 0.0), pa.int64()), pa.string())
+            texto = pc.if_else(entero, pc.binary_join_element_wise(como_entero, ".0", ""), pc.cast(column, pa.string()))
+        elif pa.types.is_boolean(field.type):
+            texto = pc.if_else(column, "True", "False")
+        else:
+            continue
+        table = table.set_column(i, field.name, texto)
+    return table
+
+# Función para escribir el tablero limpio como CSV en un archivo binario
+def _write_dataframe_csv(df, sink):
+    """
+    Escribe el DataFrame en `sink` como CSV en UTF-8 con BOM (para que Excel lo abra bien)
+    con el writer de pyarrow, que formatea por columnas en C++, sin comillas.
+    Si pyarrow no puede convertir alguna columna, o algún valor necesita comillas
+    (pyarrow las pondría en todos los textos), usa pandas.to_csv.
+    """
     try:
-        log_filename = "Errores.txt"
-        now = datetime.now()
-        log_entry = pd.DataFrame([{
-            "Fecha": now.strftime('%Y-%m-%d'),
-            "Hora": now.strftime('%H:%M'),
-            "Error": error_message,
-            "NombreArchivo": filename
-        }])
-
-        # Descargar el archivo log existente si existe
+        table = _format_like_pandas(_dataframe_to_arrow(df, para_csv=True))
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        table = None
+    if table is not None and _csv_needs_quotes(table):
+        table = None
+    # El BOM se escribe una sola vez; el resto va en UTF-8 simple
+    sink.write(codecs.BOM_UTF8)
+    if table is None:
+        df.to_csv(sink, index=False, encoding="utf-8", chunksize=_CSV_CHUNK_ROWS)
+        return
+    # Encabezado propio: sin comillas, igual que to_csv
+    sink.write((",".join(table.column_names) + "\n").encode("utf-8"))
+    # Por bloques de filas: cada bloque llega al pipe (y a la subida) apenas se formatea
+    write_options = pacsv.WriteOptions(include_header=False, delimiter=",", quoting_style="none")
+    with pacsv.CSVWriter(sink, table.schema, write_options=write_options) as writer:
+        for batch in table.to_batches(max_chunksize=_CSV_CHUNK_ROWS):
+            writer.write_batch(batch)
+
+# Función para escribir el tablero limpio como CSV comprimido con gzip
+def _write_dataframe_csv_gz(df, sink):
+    """Igual que _write_dataframe_csv, comprimido con gzip nivel 1 (el más rápido)."""
+    with gzip.GzipFile(fileobj=sink, mode="wb", compresslevel=1) as gz:
+        _write_dataframe_csv(df, gz)
+
+class _PipeReader:
+    """Extremo de lectura de un pipe; si el hilo que escribe falló, relanza su error al llegar al EOF."""
+
+    def __init__(self, fd):
+        self._file = os.fdopen(fd, "rb")
+        self.error = None
+
+    def read(self, size=-1):
+        data = self._file.read(size)
+        if not data and self.error is not None:
+            raise self.error
+        return data
+
+    def close(self):
+        self._file.close()
+
+# Función para subir a S3 lo que escribe `write_fn`, sin armar el archivo entero en memoria
+def _upload_streamed(write_fn, key, content_type):
+    """
+    Ejecuta write_fn(sink) en un hilo que escribe en un pipe, mientras upload_fileobj
+    consume el otro extremo en partes multipart. Si write_fn falla, la subida
+    se aborta con ese error (no queda un archivo truncado en S3).
+    """
+    read_fd, write_fd = os.pipe()
+    reader = _PipeReader(read_fd)
+    sink = os.fdopen(write_fd, "wb")
+
+    def produce():
         try:
-            log_obj = s3.get_object(Bucket=bucket_name, Key=log_filename)
+            write_fn(sink)
+        except Exception as e:
+            reader.error = e
+        finally:
             try:
-                log_df = pd.read_csv(BytesIO(log_obj['Body'].read()))
-            except Exception:
-                # Si el archivo existe pero está corrupto o vacío, reiniciamos
-                log_df = pd.DataFrame(columns=["Fecha", "Hora", "Error", "NombreArchivo"])
-            log_df = pd.concat([log_df, log_entry], ignore_index=True)
-        except ClientError as e:
-            code = e.response.get("Error", {}).get("Code")
-            if code in ("NoSuchKey", "404", "NoSuchBucket"):
-                log_df = log_entry  # Crear nuevo si no existe
-            else:
-                raise
+                sink.close()
+            except OSError:
+                pass  # el lector ya se cerró porque la subida falló
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        s3.upload_fileobj(
+            reader, bucket_name, key,
+            ExtraArgs={"ContentType": content_type},
+            Config=_STREAM_TRANSFER_CFG
+        )
+    finally:
+        reader.close()
+        producer.join()
 
-        # Subir el archivo log actualizado
-        csv_buffer = BytesIO()
-        log_df.to_csv(csv_buffer, index=False, encoding="utf-8-sig")
-        csv_buffer.seek(0)
-        s3.put_object(Bucket=bucket_name, Key=log_filename, Body=csv_buffer.getvalue())
+# Función para subir el tablero limpio como CSV (gzip), en streaming
+def upload_dataframe_csv_to_s3(df, filename):
+    try:
+        _upload_streamed(lambda sink: _write_dataframe_csv_gz(df, sink), filename, _ARCHIVE_CONTENT_TYPES["csv"])
+        return True
+    except Exception as e:
+        st.error(f"Error al subir el archivo: {e}")
+        return False
+
+# Tamaño máximo en memoria del archivo a subir antes de pasarlo a un temporal en disco
+_SPOOL_MAX_BYTES = 8 * 1024 ** 2
+
+# Función para serializar el tablero limpio a Parquet
+def _dataframe_to_parquet_buffer(df):
+    """
+    Serializa el DataFrame a Parquet (pyarrow, comprimido con snappy).
+    El buffer queda en memoria hasta _SPOOL_MAX_BYTES y después pasa a disco;
+    quien lo usa tiene que cerrarlo.
+    """
+    try:
+        table = _dataframe_to_arrow(df)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        # Último recurso: todo lo que no es número ni fecha se guarda como texto
+        como_texto = {
+            col: "string" for col in df.columns
+            if not (pd.api.types.is_numeric_dtype(df[col]) or pd.api.types.is_datetime64_any_dtype(df[col]))
+        }
+        table = pa.Table.from_pandas(df.astype(como_texto), preserve_index=False)
+    parquet_buffer = tempfile.SpooledTemporaryFile(max_size=_SPOOL_MAX_BYTES)
+    pq.write_table(table, parquet_buffer, compression="snappy")
+    parquet_buffer.seek(0)
+    return parquet_buffer
+
+# Función para subir el tablero limpio y registrar sus CUILs en el índice del período
+def _upload_tablero(cleaned_df, archive_filename, original_filename, periodo_str, unique_cuils, leader_name):
+    """Devuelve True si el tablero se subió."""
+    if ARCHIVE_FORMAT == "csv":
+        # El CSV se sube mientras se escribe, sin tenerlo entero en memoria
+        ok = upload_dataframe_csv_to_s3(cleaned_df, archive_filename)
+    else:
+        with _dataframe_to_parquet_buffer(cleaned_df) as archive_buffer:
+            ok = upload_file_to_s3(archive_buffer, archive_filename, _ARCHIVE_CONTENT_TYPES[ARCHIVE_FORMAT])
+    if not ok:
+        # Si falló la subida del tablero, no toco el índice
+        return False
+
+    # ✅ Actualizar índice del período con TODOS los CUILs subidos; la carga se da
+    # por buena recién cuando el índice quedó guardado
+    future = _update_period_index_with_upload(periodo_str, unique_cuils, leader_name)
+    try:
+        future.result(timeout=_INDEX_WAIT_SECONDS)
+    except Exception as e:
+        # Si se venció la espera, primero se retiran las altas del lote pendiente:
+        # el tablero solo se borra si sus CUILs no van a quedar en el índice
+        if not _withdraw_index_upload(periodo_str, future):
+            st.success(f"Archivo '{original_filename}' subido exitosamente.")
+            return True
+        motivo = str(e) or "se venció el tiempo de espera"
+        error_message = f"Error al actualizar el índice del período: {motivo}. El archivo no se guardó, volvé a subirlo."
+        _report_error(error_message, original_filename)
+        # Sin sus CUILs en el índice, el control entre líderes no vería esta carga:
+        # se borra el tablero subido
+        try:
+            s3.delete_object(Bucket=bucket_name, Key=archive_filename)
+        except Exception:
+            logger.exception("No se pudo borrar el tablero %s", archive_filename)
+        return False
+    st.success(f"Archivo '{original_filename}' subido exitosamente.")
+    return True
+
+# Función para registrar errores del procesamiento actual
+def log_error_to_s3(error_message, filename):
+    """
+    Acumula el error en la sesión. Los errores se suben a S3 todos juntos
+    al terminar el procesamiento del archivo (ver _flush_error_log).
+    """
+    now = datetime.now()
+    st.session_state.setdefault("_error_log", []).append({
+        "Fecha": now.strftime('%Y-%m-%d'),
+        "Hora": now.strftime('%H:%M'),
+        "Error": error_message,
+        "NombreArchivo": filename
+    })
+
+# Función para subir a S3 los errores acumulados
+def _flush_error_log():
+    """
+    Sube los errores acumulados en la sesión en un único objeto NDJSON
+    (una línea JSON por error) particionado por día:
+    'Errores/aaaa-mm-dd/HH-MM-SS_<id>.ndjson'.
+    No lee ni reescribe logs anteriores.
+    """
+    errores = st.session_state.pop("_error_log", None)
+    if not errores:
+        return
+    try:
+        now = datetime.now()
+        log_key = f"Errores/{now.strftime('%Y-%m-%d')}/{now.strftime('%H-%M-%S')}_{uuid.uuid4().hex[:8]}.ndjson"
+        body = "".join(json.dumps(error, ensure_ascii=False) + "\n" for error in errores)
+        s3.upload_fileobj(BytesIO(body.encode("utf-8")), bucket_name, log_key, Config=_TRANSFER_CFG)
     except Exception as e:
         st.error(f"Error al guardar el log en S3: {e}")
 
+# Función para reportar un error del procesamiento
+def _report_error(error_message, filename):
+    """
+    Guarda el mensaje para mostrarlo junto con los demás al final del
+    procesamiento (ver _render_errors) y lo registra en el log de errores.
+    Desde un hilo del pool de hojas se guarda en el _SheetReport de la hoja.
+    """
+    report = _current_sheet_report()
+    if report is not None:
+        report.errors.append((error_message, filename))
+        return
+    st.session_state.setdefault("_error_messages", []).append(error_message)
+    log_error_to_s3(error_message, filename)
+
+# Función para mostrar un error sin registrarlo en el log
+def _show_error(error_message):
+    report = _current_sheet_report()
+    if report is not None:
+        report.errors.append((error_message, None))
+    else:
+        st.error(error_message)
+
+# Función para mostrar los errores acumulados
+def _render_errors():
+    """
+    Muestra todos los errores del procesamiento en un único st.error.
+    """
+    mensajes = st.session_state.pop("_error_messages", None)
+    if mensajes:
+        st.error("\n\n".join(mensajes))
+
 # Verificar formato del nombre del archivo
 def validate_filename(filename):
-    pattern = r"^\d{2}-\d{2}-\d{4}\+.+\+.+\.xlsx$"
-    return re.match(pattern, filename)
+    return _FILENAME_RE.match(filename)
 
 # Función para validar la fecha del archivo
 def validate_file_date(filename):
@@ -284,13 +722,13 @@ def extract_udig_from_form(sheet_data, sheet_name, filename):
 
 
         if parsed is None:
-            st.warning(f"UDIG detectado (A5='UDIG') pero B5 está vacío en hoja '{sheet_name}'. Se cargará sin UDIG.")
+            _parse_warning(f"UDIG detectado (A5='UDIG') pero B5 está vacío en hoja '{sheet_name}'. Se cargará sin UDIG.")
             return None
 
         if parsed == "INVALID":
-            st.warning(f"UDIG detectado (A5='UDIG') pero B5 es inválido en hoja '{sheet_name}'. Se cargará sin UDIG.")
+            _parse_warning(f"UDIG detectado (A5='UDIG') pero B5 es inválido en hoja '{sheet_name}'. Se cargará sin UDIG.")
             # Opcional: también loguearlo
-            log_error_to_s3(f"UDIG inválido en B5 (hoja {sheet_name}).", filename)
+            _parse_log(f"UDIG inválido en B5 (hoja {sheet_name}).", filename)
             return None
 
         return parsed
@@ -299,59 +737,57 @@ def extract_udig_from_form(sheet_data, sheet_name, filename):
         # Si no existen esas filas/columnas (archivo viejo) u otro error de índice: no bloqueamos
         return None
 
+# Celdas del formulario (A1:K5) como un único ndarray
+def _form_block(sheet_data):
+    """
+    Devuelve el bloque A1:K5 de la hoja como ndarray, para leer las celdas del
+    formulario con indexado de NumPy en lugar de un .iloc/.at por celda.
+    """
+    return sheet_data.iloc[:5, :11].to_numpy()
+
 # Verificar celdas del formulario
 def validate_form_cells(sheet_data, sheet_name, filename):
     try:
-        required_cells = ['B1', 'B2', 'B3', 'B4']
-        for cell in required_cells:
-            if pd.isna(sheet_data.at[int(cell[1])-1, 1]):
-                error_message = f"Error: La celda {cell} en la hoja '{sheet_name}' está vacía."
-                st.error(error_message)
-                log_error_to_s3(error_message, filename)
-                return False
-
-        cuil = str(sheet_data.at[1, 1])
-        if not re.match(r"^\d{11}$", cuil):
+        form = _form_block(sheet_data)
+        # B1..B4 obligatorias
+        vacias = pd.isna(form[:4, 1])
+        if vacias.any():
+            error_message = f"Error: La celda B{int(vacias.argmax()) + 1} en la hoja '{sheet_name}' está vacía."
+            _report_error(error_message, filename)
+            return False
+
+        cuil = str(form[1, 1])
+        if not _CUIL_RE.match(cuil):
             error_message = f"Error: La celda B2 en la hoja '{sheet_name}' debe contener 11 números."
-            st.error(error_message)
-            log_error_to_s3(error_message, filename)
+            _report_error(error_message, filename)
             return False
 
         # Validar que los campos de comisiones y horas extra sean números o nulos
-        comisiones_accesorias = sheet_data.at[0, 10]
-        hs_extras_50 = sheet_data.at[1, 10]
-        hs_extras_100 = sheet_data.at[2, 10]
-        incentivo_productividad = sheet_data.at[3, 10]
-        ajuste_incentivo = sheet_data.at[4, 10]
+        comisiones_accesorias, hs_extras_50, hs_extras_100, incentivo_productividad, ajuste_incentivo = form[:5, 10]
 
         if not (pd.isna(comisiones_accesorias) or (isinstance(comisiones_accesorias, (int, float)) and float(comisiones_accesorias).is_integer())):
             error_message = f"Error: La celda K1 en la hoja '{sheet_name}' debe contener un número entero."
-            st.error(error_message)
-            log_error_to_s3(error_message, filename)
+            _report_error(error_message, filename)
             return False
 
         if not (pd.isna(hs_extras_50) or isinstance(hs_extras_50, (int, float))):
             error_message = f"Error: La celda K2 en la hoja '{sheet_name}' debe contener solo números."
-            st.error(error_message)
-            log_error_to_s3(error_message, filename)
+            _report_error(error_message, filename)
             return False
 
         if not (pd.isna(hs_extras_100) or isinstance(hs_extras_100, (int, float))):
             error_message = f"Error: La celda K3 en la hoja '{sheet_name}' debe contener solo números."
-            st.error(error_message)
-            log_error_to_s3(error_message, filename)
+            _report_error(error_message, filename)
             return False
 
         if not (pd.isna(incentivo_productividad) or (isinstance(incentivo_productividad, (int, float)) and float(incentivo_productividad).is_integer())):
             error_message = f"Error: La celda K4 en la hoja '{sheet_name}' debe contener un número entero."
-            st.error(error_message)
-            log_error_to_s3(error_message, filename)
+            _report_error(error_message, filename)
             return False
 
         if not (pd.isna(ajuste_incentivo) or (isinstance(ajuste_incentivo, (int, float)) and float(ajuste_incentivo).is_integer())):
             error_message = f"Error: La celda K5 en la hoja '{sheet_name}' debe contener un número entero."
-            st.error(error_message)
-            log_error_to_s3(error_message, filename)
+            _report_error(error_message, filename)
             return False
 
         # --- UDIG opcional (A5/B5) ---
@@ -361,8 +797,7 @@ def validate_form_cells(sheet_data, sheet_name, filename):
         return True
     except Exception as e:
         error_message = f"Error al validar las celdas del formulario en la hoja '{sheet_name}': {e}"
-        st.error(error_message)
-        log_error_to_s3(error_message, filename)
+        _report_error(error_message, filename)
         return False
 
 # Verificar columnas requeridas
@@ -382,8 +817,7 @@ def validate_required_columns(data):
 def validate_ponderacion(data, filename):
     if (data['Ponderacion'] == 0).any():
         error_message = "Error: Existen filas con Ponderacion 0%."
-        st.error(error_message)
-        log_error_to_s3(error_message, filename)
+        _report_error(error_message, filename)
         return False
     return True
 
@@ -392,8 +826,7 @@ def validate_ponderacion_sum(data, filename, sheet_name):
     ponderacion_sum = data['Ponderacion'].sum()
     if not (0.99 <= ponderacion_sum <= 1.1):
         error_message = f"Error: La suma de la columna Ponderacion en la hoja '{sheet_name}' es {ponderacion_sum * 100:.2f}%, no es 100%."
-        st.error(error_message)
-        log_error_to_s3(error_message, filename)
+        _report_error(error_message, filename)
         return False
     return True
 
@@ -401,51 +834,54 @@ def validate_ponderacion_sum(data, filename, sheet_name):
 def verify_sheet_structure(sheet_data, sheet_name, filename):
     if sheet_data.empty or sheet_data.shape[1] < 1:
         error_message = f"Error: La hoja '{sheet_name}' está vacía o no tiene suficientes columnas."
-        st.error(error_message)
-        log_error_to_s3(error_message, filename)
+        _report_error(error_message, filename)
         return False
     return True
 
 # Función para extraer datos del formulario
 def extract_data_from_form(sheet_data, sheet_name, filename):
     try:
-        cargo = sheet_data.iloc[0, 1]
+        form = _form_block(sheet_data)
+        cargo = form[0, 1]
         # Si cargo contiene una coma, lo envuelve entre comillas
         if isinstance(cargo, str) and ',' in cargo:
             cargo = f'"{cargo}"'
-        cuil = sheet_data.iloc[1, 1]
-        segmento = sheet_data.iloc[2, 1]
-        area_influencia = sheet_data.iloc[3, 1]
-        comisiones_accesorias = sheet_data.iloc[0, 10]
-        hs_extras_50 = sheet_data.iloc[1, 10]
-        hs_extras_100 = sheet_data.iloc[2, 10]
-        incentivo_productividad = sheet_data.iloc[3, 10]
-        ajuste_incentivo = sheet_data.iloc[4, 10]
+        cuil = form[1, 1]
+        segmento = form[2, 1]
+        area_influencia = form[3, 1]
+        comisiones_accesorias = form[0, 10]
+        hs_extras_50 = form[1, 10]
+        hs_extras_100 = form[2, 10]
+        incentivo_productividad = form[3, 10]
+        ajuste_incentivo = form[4, 10]
         udig = extract_udig_from_form(sheet_data, sheet_name, filename)
         return cargo, cuil, segmento, area_influencia, comisiones_accesorias, hs_extras_50, hs_extras_100, incentivo_productividad, ajuste_incentivo, udig
     except IndexError:
         return None, None, None, None, None, None, None, None, None, None
 
 # Función para contar filas hasta encontrar una vacía
-def count_rows_until_empty(data, column_name="Indicadores de Gestion"):
+def count_rows_until_empty(data, header_row):
+    """
+    Cuenta las filas debajo del encabezado hasta la primera celda vacía de la
+    columna 'Indicadores de Gestion' (columna C). Si no hay ninguna vacía,
+    cuenta hasta el final de la hoja.
+    """
     try:
-        header_index = data[data.iloc[:, 2] == column_name].index[0]
-        relevant_rows = data.iloc[header_index + 1:, 2]
-        return relevant_rows.isna().idxmax() - (header_index + 1)
+        vacias = pd.isna(data.iloc[header_row + 1:, 2].to_numpy())
+        return int(vacias.argmax()) if vacias.any() else len(vacias)
     except Exception as e:
-        st.error(f"Error contando filas hasta vacío: {e}")
+        _show_error(f"Error contando filas hasta vacío: {e}")
         return 0
 
 # Función para limpiar y reestructurar datos
 def clean_and_restructure_until_empty(data, cargo, cuil, segmento, area_influencia, leader_name, fecha, sucursal, filename, upload_datetime, sheet_name, comisiones_accesorias, hs_extras_50, hs_extras_100, incentivo_productividad, ajuste_incentivo, udig):
     try:
         header_row = data[data.iloc[:, 0] == 'Tipo Indicador'].index[0]
-        rows_to_process = count_rows_until_empty(data, "Indicadores de Gestion")
+        rows_to_process = count_rows_until_empty(data, header_row)
 
         if rows_to_process == 0:
             error_message = "Error: No se encontraron filas válidas después del encabezado."
-            st.error(error_message)
-            log_error_to_s3(error_message, filename)
+            _report_error(error_message, filename)
             return pd.DataFrame()
 
         data.columns = data.iloc[header_row]
@@ -471,8 +907,7 @@ def clean_and_restructure_until_empty(data, cargo, cuil, segmento, area_influenc
         valid_columns, missing_columns = validate_required_columns(data)
         if not valid_columns:
             error_message = f"Error: Faltan las siguientes columnas requeridas: {', '.join(missing_columns)}"
-            st.error(error_message)
-            log_error_to_s3(error_message, filename)
+            _report_error(error_message, filename)
             return pd.DataFrame()
 
         # Validar que los objetivos sean numéricos (entero, decimal o porcentaje)
@@ -482,44 +917,29 @@ def clean_and_restructure_until_empty(data, cargo, cuil, segmento, area_influenc
             'Objetivo Excelente (120%)'
         ]
         for col in objetivo_cols:
-            # Intentar convertir a numérico, si falla o hay texto, marcar error
-            def is_valid_objetivo(x):
-                if pd.isna(x) or isinstance(x, (int, float)):
-                    return True
-                if isinstance(x, str):
-                    return bool(re.match(r"^\s*-?\d+(\.\d+)?\s*%?\s*$", x))
-                return False
-            invalid_mask = ~data[col].apply(is_valid_objetivo)
-            if invalid_mask.any():
+            raw = data[col]
+            es_texto = raw.map(type) == str
+            # Las celdas que no son texto se convierten directo; si no son números, son inválidas
+            valores = pd.to_numeric(raw.where(~es_texto), errors="coerce").astype(float)
+            no_numericos = valores.isna() & raw.notna() & ~es_texto
+            # Todo texto tiene que ser tipo '10', '-2.5', '10%' o ' 10 ' (no '1e5', 'inf', '+5', ...)
+            # Con almacenamiento pyarrow, los métodos .str corren como kernels de pyarrow.compute
+            texto = raw[es_texto].astype("string[pyarrow]").str.strip()
+            if no_numericos.any() or not texto.str.fullmatch(_OBJETIVO_RE.pattern).all():
                 error_message = (f"Error: La columna '{col}' contiene valores no numéricos o texto en la hoja '{sheet_name}'.")
-                st.error(error_message)
-                log_error_to_s3(error_message, filename)
-                return pd.DataFrame()
-            # Convertir strings con % o números a float
-            def parse_objetivo(val):
-                if pd.isna(val):
-                    return val
-                if isinstance(val, (int, float)):
-                    return float(val)
-                if isinstance(val, str):
-                    val = val.strip().replace(",", ".")
-                    if val.endswith("%"):
-                        try:
-                            return float(val.rstrip("%").strip()) / 100
-                        except:
-                            return None
-                    try:
-                        return float(val)
-                    except:
-                        return None
-                return None
-            data[col] = data[col].apply(parse_objetivo)
-            # Si después de convertir hay algún valor que NO sea numérico y NO sea nulo, es error
-            if not data[col].dropna().apply(lambda x: isinstance(x, float)).all():
-                error_message = (f"Error: La columna '{col}' contiene valores no numéricos válidos en la hoja '{sheet_name}'.")
-                st.error(error_message)
-                log_error_to_s3(error_message, filename)
+                _report_error(error_message, filename)
                 return pd.DataFrame()
+            if not texto.empty:
+                # Convertir strings con % a float
+                porcentaje = texto.str.endswith("%")
+                numeros = pd.to_numeric(texto.str.rstrip("%").str.strip()).astype(float)
+                valores[es_texto] = numeros.where(~porcentaje, numeros / 100)
+            data[col] = valores
+
+        # Se parsea una sola vez al armar la hoja; nulos y formatos inválidos quedan como NaT
+        data['Ultima Fecha de Actualización'] = pd.to_datetime(
+            data['Ultima Fecha de Actualización'], format='%d/%m/%Y', errors='coerce'
+        )
 
         if not validate_ponderacion(data, filename):
             return pd.DataFrame()
@@ -534,7 +954,7 @@ def clean_and_restructure_until_empty(data, cargo, cuil, segmento, area_influenc
         data['Nombre Lider'] = leader_name
         data['Fecha_Nombre_Archivo'] = fecha
         data['Sucursal'] = sucursal
-        data['Fecha Horario Subida'] = upload_datetime
+        data['Fecha Horario Subida'] = upload_datetime.strftime('%d/%m/%Y_%H:%M:%S')
         data['COMISIONES ACCESORIAS'] = comisiones_accesorias
         data['HS EXTRAS AL 50'] = hs_extras_50
         data['HS EXTRAS AL 100'] = hs_extras_100
@@ -553,53 +973,256 @@ def clean_and_restructure_until_empty(data, cargo, cuil, segmento, area_influenc
         return data[desired_columns]
     except Exception as e:
         error_message = f"Error al limpiar y reestructurar: {e}"
-        st.error(error_message)
-        log_error_to_s3(error_message, filename)
+        _report_error(error_message, filename)
         return pd.DataFrame()
 
 # Función para verificar si hay CUILs repetidos en diferentes hojas
 def validate_unique_cuils(dataframes):
-    cuils = []
+    seen = set()
     for df in dataframes:
-        cuils.extend(df['CUIL'].unique())
-    if len(cuils) != len(set(cuils)):
-        return False
+        for cuil in df['CUIL'].unique():
+            if cuil in seen:
+                return False  # corta en el primer repetido
+            seen.add(cuil)
     return True
 
+# Textos que pandas.read_excel interpreta como nulos (na_values por defecto)
+_NA_STRINGS = frozenset([
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan",
+    "1.#IND", "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+])
+
+def _convert_cell(value):
+    """
+    Normaliza un valor leído con openpyxl o calamine igual que pandas.read_excel:
+    textos nulos (calamine devuelve "" en celdas vacías) y errores de Excel
+    (#DIV/0!, #REF!, ...) -> None, números enteros guardados como float -> int,
+    fechas sin hora (calamine) -> datetime, como las devuelve openpyxl.
+    """
+    if isinstance(value, str):
+        if value in _NA_STRINGS or value in ERROR_CODES:
+            return None
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, date) and not isinstance(value, datetime):
+        return datetime(value.year, value.month, value.day)
+    return value
+
+# Columnas que se usan de cada hoja: A..M (formulario en A/B/K y datos en A..M)
+_SHEET_MAX_COL = 13
+
+class _CalamineWorkbook:
+    """
+    Excel leído con python-calamine (parser en Rust, varias veces más rápido que
+    openpyxl). Devuelve los valores cacheados de las fórmulas, como data_only=True.
+    Expone lo que usa process_sheets_until_empty: sheetnames, iter_rows y close.
+    Si calamine falla al leer una hoja, esa hoja se relee con openpyxl
+    (ver fallback_workbook).
+    """
+
+    def __init__(self, file_bytes):
+        self._book = CalamineWorkbook.from_filelike(BytesIO(file_bytes))
+        self._lock = threading.Lock()  # el workbook de calamine no admite accesos concurrentes
+        self._file_bytes = file_bytes
+        self._fallback = None
+        self.sheetnames = list(self._book.sheet_names)
+
+    def iter_rows(self, sheet_name):
+        """
+        Filas de la hoja desde la fila 1, recortadas o completadas a las columnas A..M.
+        Las filas se convierten a objetos Python de a una (iter_rows de calamine),
+        así _read_sheet puede cortar al final del bloque de indicadores; el lock
+        cubre solo la carga de la hoja, no la lectura de filas.
+        """
+        with self._lock:
+            sheet = self._book.get_sheet_by_name(sheet_name)
+        if sheet.start is None:
+            return  # hoja vacía
+        # iter_rows de calamine ya arranca en la fila 1, pero las columnas empiezan
+        # en la primera columna usada: se completan las de la izquierda hasta A
+        first_col = sheet.start[1]
+        width = max(0, _SHEET_MAX_COL - first_col)
+        for row in sheet.iter_rows():
+            row = ((None,) * first_col + tuple(row[:width]))[:_SHEET_MAX_COL]
+            yield row + (None,) * (_SHEET_MAX_COL - len(row))
+
+    def fallback_workbook(self):
+        """El mismo archivo abierto con openpyxl, para releer las hojas que calamine no pudo leer."""
+        with self._lock:
+            if self._fallback is None:
+                self._fallback = openpyxl.load_workbook(BytesIO(self._file_bytes), read_only=True, data_only=True, keep_links=False)
+            return self._fallback
+
+    def close(self):
+        close = getattr(self._book, "close", None)  # solo en versiones recientes
+        if close is not None:
+            close()
+        if self._fallback is not None:
+            self._fallback.close()
+
+# Función para abrir el Excel subido
+def _open_workbook(file_bytes):
+    """
+    Abre el Excel con python-calamine; si no está instalado o no puede leer el
+    archivo, con openpyxl en modo solo lectura (las hojas se recorren fila por fila
+    sin cargar todo el modelo de celdas).
+    """
+    if CalamineWorkbook is not None:
+        try:
+            return _CalamineWorkbook(file_bytes)
+        except Exception:
+            logger.warning("python-calamine no pudo abrir el archivo; se usa openpyxl", exc_info=True)
+    return openpyxl.load_workbook(BytesIO(file_bytes), read_only=True, data_only=True, keep_links=False)
+
+def _iter_sheet_rows(workbook, sheet_name):
+    """Filas crudas (columnas A..M) de una hoja, para cualquiera de los dos lectores."""
+    if isinstance(workbook, _CalamineWorkbook):
+        return workbook.iter_rows(sheet_name)
+    worksheet = workbook[sheet_name]
+    worksheet.reset_dimensions()  # las dimensiones guardadas en el xlsx pueden estar mal
+    return worksheet.iter_rows(max_col=_SHEET_MAX_COL, values_only=True)
+
+# Función para leer una hoja del Excel sin encabezado
+def _read_sheet(workbook, sheet_name):
+    """
+    Lee la hoja fila por fila y arma el DataFrame una sola vez, con las mismas
+    posiciones que ExcelFile.parse(sheet_name, header=None).
+    Solo se leen las columnas A..M, y la lectura termina en la primera fila
+    con 'Indicadores de Gestion' (columna C) vacía debajo del encabezado
+    'Tipo Indicador'; esa fila vacía se incluye para marcar el fin de los datos.
+    """
+    try:
+        return _collect_sheet_rows(_iter_sheet_rows(workbook, sheet_name))
+    except Exception:
+        if not isinstance(workbook, _CalamineWorkbook):
+            raise
+        # La hoja se vuelve a leer entera con openpyxl; las demás siguen con calamine
+        logger.warning("python-calamine no pudo leer la hoja '%s'; se usa openpyxl", sheet_name, exc_info=True)
+        return _collect_sheet_rows(_iter_sheet_rows(workbook.fallback_workbook(), sheet_name))
+
+def _collect_sheet_rows(sheet_rows):
+    """Arma el DataFrame de _read_sheet a partir de las filas crudas de la hoja."""
+    rows = []
+    header_found = False
+    for row in sheet_rows:
+        row = tuple(_convert_cell(value) for value in row)
+        rows.append(row)
+        if header_found and row[2] is None:
+            break  # fin del bloque de indicadores
+        if not header_found and row[0] == 'Tipo Indicador':
+            header_found = True
+    # Igual que pandas, se descartan las filas vacías del final
+    while rows and all(value is None for value in rows[-1]):
+        rows.pop()
+    return pd.DataFrame(rows)
+
+# Mensajes de la hoja que se procesa en el hilo actual (ver _process_one_sheet)
+_sheet_report = threading.local()
+
+class _SheetReport:
+    """
+    Errores, avisos y logs de una hoja. Los hilos del pool no tocan st.* ni el
+    estado de la sesión: process_sheets_until_empty los emite después, en el
+    hilo del script y en el orden de las hojas.
+    """
+
+    def __init__(self):
+        self.errors = []  # (mensaje, archivo o None si no va al log de errores)
+        self.warnings = []
+        self.logs = []  # (mensaje, archivo)
+
+    def emit(self):
+        for message in self.warnings:
+            _parse_warning(message)
+        for message, filename in self.logs:
+            _parse_log(message, filename)
+        for message, filename in self.errors:
+            if filename is None:
+                st.error(message)
+            else:
+                _report_error(message, filename)
+
+def _current_sheet_report():
+    return getattr(_sheet_report, "current", None)
+
+# Función para procesar una hoja del Excel
+def _process_one_sheet(workbook, sheet_name, filename, leader_name, fecha, sucursal, upload_datetime):
+    """
+    Parsea y valida una hoja. Se ejecuta en un hilo del pool.
+    Devuelve (DataFrame procesado o None, ok, _SheetReport). None con ok=True indica
+    que la hoja no tiene datos de formulario y se omite.
+    """
+    report = _SheetReport()
+    _sheet_report.current = report
+    try:
+        return (*_validate_one_sheet(workbook, sheet_name, filename, leader_name, fecha, sucursal, upload_datetime), report)
+    finally:
+        _sheet_report.current = None
+
+def _validate_one_sheet(workbook, sheet_name, filename, leader_name, fecha, sucursal, upload_datetime):
+    sheet_data = _read_sheet(workbook, sheet_name)
+    if not verify_sheet_structure(sheet_data, sheet_name, filename):
+        return None, False
+    if not validate_form_cells(sheet_data, sheet_name, filename):
+        return None, False
+    cargo, cuil, segmento, area_influencia, comisiones_accesorias, hs_extras_50, hs_extras_100, incentivo_productividad, ajuste_incentivo, udig = extract_data_from_form(sheet_data, sheet_name, filename)
+    if not (cargo and cuil and segmento and area_influencia):
+        return None, True
+    processed_data = clean_and_restructure_until_empty(sheet_data, cargo, cuil, segmento, area_influencia, leader_name, fecha, sucursal, filename, upload_datetime, sheet_name, comisiones_accesorias, hs_extras_50, hs_extras_100, incentivo_productividad, ajuste_incentivo, udig)
+    if processed_data.empty:
+        return None, False
+    if not validate_update_dates(processed_data, filename, sheet_name):
+        return None, False
+    return processed_data, True
+
+# Columnas con un mismo valor repetido en todas las filas de una hoja
+_CATEGORY_COLUMNS = [
+    'Cargo', 'CUIL', 'Segmento', 'Área de influencia', 'Nombre Lider', 'Sucursal',
+    'Tipo Indicador', 'Tipo Dato'
+]
+
 # Función para procesar hojas del Excel
-def process_sheets_until_empty(excel_data, filename, upload_datetime):
-    final_data = pd.DataFrame()
+def process_sheets_until_empty(workbook, filename, upload_datetime):
     leader_name = extract_leader_name(filename)
     fecha, sucursal = extract_date_and_sucursal(filename)
     dataframes = []
-    for sheet_name in excel_data.sheet_names:
-        sheet_data = excel_data.parse(sheet_name, header=None)
-        if not verify_sheet_structure(sheet_data, sheet_name, filename):
-            return pd.DataFrame(), False  # Return empty DataFrame and error state
-        if not validate_form_cells(sheet_data, sheet_name, filename):
-            return pd.DataFrame(), False  # Return empty DataFrame and error state
-        cargo, cuil, segmento, area_influencia, comisiones_accesorias, hs_extras_50, hs_extras_100, incentivo_productividad, ajuste_incentivo, udig = extract_data_from_form(sheet_data, sheet_name, filename)
-        if cargo and cuil and segmento and area_influencia:
-            processed_data = clean_and_restructure_until_empty(sheet_data, cargo, cuil, segmento, area_influencia, leader_name, fecha, sucursal, filename, upload_datetime, sheet_name, comisiones_accesorias, hs_extras_50, hs_extras_100, incentivo_productividad, ajuste_incentivo, udig)
-            if processed_data.empty:
-                return pd.DataFrame(), False  # Return empty DataFrame and error state
-            if not validate_update_dates(processed_data, filename, sheet_name):
+    sheet_names = workbook.sheetnames
+    # Las hojas son independientes hasta la validación de CUILs: se procesan en paralelo
+    with ThreadPoolExecutor(max_workers=max(1, min(8, len(sheet_names)))) as executor:
+        futures = [
+            executor.submit(_process_one_sheet, workbook, sheet_name, filename, leader_name, fecha, sucursal, upload_datetime)
+            for sheet_name in sheet_names
+        ]
+        # Se recorren en el orden de las hojas: los mensajes salen en ese orden y,
+        # como al procesarlas una por una, solo hasta la primera hoja con error
+        for future in futures:
+            processed_data, ok, report = future.result()
+            report.emit()
+            if not ok:
+                executor.shutdown(cancel_futures=True)
                 return pd.DataFrame(), False  # Return empty DataFrame and error state
-            dataframes.append(processed_data)
-            final_data = pd.concat([final_data, processed_data], ignore_index=True)
-    
+            if processed_data is not None:
+                dataframes.append(processed_data)
+
     if not validate_unique_cuils(dataframes):
         error_message = "Error: Existen CUILs repetidos en diferentes hojas del archivo."
-        st.error(error_message)
-        log_error_to_s3(error_message, filename)
+        _report_error(error_message, filename)
         return pd.DataFrame(), False  # Return empty DataFrame and error state
 
+    if not dataframes:
+        return pd.DataFrame(), True
+
+    # Un único concat al final: concatenar dentro del loop copia lo acumulado en cada hoja
+    final_data = pd.concat(dataframes, ignore_index=True)
+    # Se convierten después del concat: categorías distintas por hoja harían que concat vuelva a object
+    final_data = final_data.astype({col: "category" for col in _CATEGORY_COLUMNS})
     return final_data, True  # Return DataFrame and success state
 
 # Función para determinar si el tablero es "Ajuste" o "Normal"
 def determine_tablero_type(fecha, upload_datetime):
     # Fecha de ajuste
-    ajuste_fecha = datetime(upload_datetime.year, upload_datetime.month, 26)
+    ajuste_fecha = datetime(upload_datetime.year, upload_datetime.month, 26, tzinfo=upload_datetime.tzinfo)
     file_date = datetime.strptime(fecha, '%d-%m-%Y')
     now = upload_datetime
 
@@ -627,47 +1250,31 @@ def determine_tablero_type(fecha, upload_datetime):
 # Función para verificar fechas en la columna "Ultima Fecha de Actualización"
 def validate_update_dates(data, filename, sheet_name):
     try:
-        argentina_tz = pytz.timezone("America/Argentina/Buenos_Aires")
-        now = datetime.now(argentina_tz)
-        now = pd.to_datetime(now.strftime('%Y-%m-%d'))  # Convertir la fecha actual al mismo tipo de datos
+        now = pd.Timestamp(datetime.now(ARGENTINA_TZ).date())  # Fecha actual (sin hora) como Timestamp
 
         # Verificar si la columna existe
         if 'Ultima Fecha de Actualización' not in data.columns:
             error_message = f"Error: La columna 'Ultima Fecha de Actualización' no existe en la hoja '{sheet_name}'."
-            st.error(error_message)
-            log_error_to_s3(error_message, filename)
-            return False
-
-        # Verificar valores nulos
-        if data['Ultima Fecha de Actualización'].isna().any():
-            error_message = f"Error: Existen valores nulos en la columna 'Ultima Fecha de Actualización' en la hoja '{sheet_name}'."
-            st.error(error_message)
-            log_error_to_s3(error_message, filename)
+            _report_error(error_message, filename)
             return False
 
-        # Verificar formato de fecha
-        data['Ultima Fecha de Actualización'] = pd.to_datetime(
-            data['Ultima Fecha de Actualización'], format='%d/%m/%Y', errors='coerce'
-        )
-        if data['Ultima Fecha de Actualización'].isna().any():
-            error_message = f"Error: Existen valores en la columna 'Ultima Fecha de Actualización' en la hoja '{sheet_name}' que no tienen el formato de fecha válido (%d/%m/%Y)."
-            st.error(error_message)
-            log_error_to_s3(error_message, filename)
+        # La columna ya viene parseada (clean_and_restructure_until_empty): NaT = vacía o con formato inválido
+        fechas = data['Ultima Fecha de Actualización']
+        if fechas.isna().any():
+            error_message = f"Error: Existen valores nulos o que no tienen el formato de fecha válido (%d/%m/%Y) en la columna 'Ultima Fecha de Actualización' en la hoja '{sheet_name}'."
+            _report_error(error_message, filename)
             return False
 
         # Verificar fechas futuras
-        invalid_dates = data[data['Ultima Fecha de Actualización'] > now]
-        if not invalid_dates.empty:
+        if (fechas > now).any():
             error_message = f"Error: Existen fechas en la columna 'Ultima Fecha de Actualización' en la hoja '{sheet_name}' que son posteriores a la fecha actual."
-            st.error(error_message)
-            log_error_to_s3(error_message, filename)
+            _report_error(error_message, filename)
             return False
 
         return True
     except Exception as e:
         error_message = f"Error al validar las fechas en la columna 'Ultima Fecha de Actualización' en la hoja '{sheet_name}': {e}"
-        st.error(error_message)
-        log_error_to_s3(error_message, filename)
+        _report_error(error_message, filename)
         return False
 
 # Función para verificar duplicados en S3
@@ -682,101 +1289,292 @@ def check_for_duplicates(cuils, fecha_normalizada, leader_name):
         periodo = normalize_fecha_to_first_day(fecha_normalizada)  # '01-mm-aaaa'
         idx_df = _load_period_index(periodo)
 
-        if idx_df.empty:
+        existing = {} if idx_df.empty else _index_leaders_by_cuil(idx_df)
+        # Altas de subidas recientes que todavía no se guardaron en S3
+        for c, lider in _pending_index_leaders(periodo).items():
+            existing.setdefault(c, lider)
+        if not existing:
             return False, []  # no hay índice -> no hay conflictos
 
         conflicts = []
-        # normalizo a str para evitar problemas de comparación
-        idx_df["CUIL"] = idx_df["CUIL"].astype(str)
-        cuils_str = [str(c) for c in cuils]
-
-        for c in cuils_str:
-            row = idx_df.loc[idx_df["CUIL"] == c]
-            if not row.empty:
-                existing_leader = (None if row["Lider"].isna().iloc[0]
-                                   else str(row["Lider"].iloc[0]))
-                if existing_leader and existing_leader != leader_name:
-                    conflicts.append((c, existing_leader))
+        for c in map(str, cuils):
+            existing_leader = existing.get(c)
+            if existing_leader and existing_leader != leader_name:
+                conflicts.append((c, existing_leader))
 
         return (len(conflicts) > 0), conflicts
     except Exception as e:
         st.error(f"Error al verificar duplicados en índice del período: {e}")
         return False, []
 
+def _index_leaders_by_cuil(idx_df):
+    """
+    Arma un dict CUIL -> líder a partir del índice del período, para buscar
+    cada CUIL en O(1). Si un CUIL aparece más de una vez, vale la primera fila.
+    El líder nulo se devuelve como None.
+    """
+    primeros = idx_df.drop_duplicates(subset="CUIL")
+    return {
+        cuil: (None if pd.isna(lider) else str(lider))
+        for cuil, lider in zip(primeros["CUIL"], primeros["Lider"])
+    }
+
 def _update_period_index_with_upload(periodo_str, cuils, leader_name):
     """
-    Agrega todos los CUILs al índice '<Periodo>/indice.csv' en una sola operación:
+    Encola todos los CUILs para agregarlos al índice '<Periodo>/indice.parquet'.
+    El guardado lo hace _flush_pending_index en segundo plano, con un solo PUT
+    por período aunque haya varias subidas seguidas:
     - Si el CUIL no existe: se agrega (Periodo, CUIL, Lider).
     - Si existe con el mismo líder: no hace nada.
     - Si existe con OTRO líder: no lo pisa (esto ya debería haberse bloqueado antes).
+    Devuelve un Future que se completa cuando el lote queda guardado (o falla).
     """
-    try:
-        df = _load_period_index(periodo_str)
-        df["CUIL"] = df["CUIL"].astype(str) if "CUIL" in df.columns and not df.empty else df.get("CUIL", pd.Series(dtype=str))
+    future = Future()
+    with _PENDING_INDEX_LOCK:
+        _PENDING_INDEX.setdefault(periodo_str, _IndexBatch()).agregar(future, tuple(map(str, cuils)), leader_name)
+    _ensure_index_flusher()
+    return future
 
-        to_add = []
-        cuils_str = [str(c) for c in cuils]
+def _withdraw_index_upload(periodo_str, future):
+    """
+    Retira del lote pendiente las altas de una subida que dejó de esperar su guardado.
+    Si el lote se está guardando en este momento, espera a que termine ese intento:
+    si falló vuelve a quedar pendiente y se retira; si se guardó, ya no se puede.
+    Devuelve True si las altas de la subida no quedaron (ni van a quedar) en el índice.
+    """
+    while True:
+        with _PENDING_INDEX_LOCK:
+            batch = _PENDING_INDEX.get(periodo_str)
+            if batch is not None and future in batch.subidas:
+                batch.quitar(future)
+                if not batch.subidas:
+                    del _PENDING_INDEX[periodo_str]
+                future.cancel()
+                return True
+        if future.done():
+            return future.exception() is not None
+        time.sleep(_INDEX_FLUSH_SECONDS)
+
+def _pending_index_leaders(periodo_str):
+    """Altas del período que todavía no están guardadas en S3 (CUIL -> líder)."""
+    leaders = {}
+    with _PENDING_INDEX_LOCK:
+        for lotes in (_FLUSHING_INDEX, _PENDING_INDEX):
+            batch = lotes.get(periodo_str)
+            if batch is not None:
+                for c, lider in batch.altas.items():
+                    leaders.setdefault(c, lider)
+    return leaders
+
+def _save_index_batch(periodo_str, batch):
+    df = _load_period_index(periodo_str)
+    existing = _index_leaders_by_cuil(df)
+    to_add = [
+        {"Periodo": periodo_str, "CUIL": c, "Lider": lider}
+        for c, lider in batch.altas.items()
+        if c not in existing
+    ]
+    # Si todos los CUILs ya estaban (re-subida del mismo líder) no hay nada que guardar
+    if to_add:
+        df = pd.concat([df, pd.DataFrame(to_add)], ignore_index=True)
+        _save_period_index(df, periodo_str)
 
-        for c in cuils_str:
-            if not df.empty and "CUIL" in df.columns:
-                mask = df["CUIL"] == c
-            else:
-                mask = pd.Series([], dtype=bool)
-
-            if mask.any():
-                existing_leader = str(df.loc[mask, "Lider"].iloc[0]) if not df.loc[mask, "Lider"].isna().iloc[0] else None
-                if existing_leader == leader_name:
-                    continue  # ya está con el mismo líder
-                else:
-                    # existe con otro líder -> no se sobreescribe (ya fue validado)
-                    continue
+def _flush_pending_index():
+    """
+    Guarda en S3 los lotes pendientes que ya están listos, un PUT por período.
+    Mientras se guardan siguen visibles para check_for_duplicates (_FLUSHING_INDEX).
+    Si el guardado falla, el lote se reintenta con espera exponencial, sumando las
+    altas que llegaron mientras tanto; después de _INDEX_MAX_ATTEMPTS intentos se
+    descarta y el error llega a las subidas que lo esperan.
+    """
+    ahora = time.monotonic()
+    with _PENDING_INDEX_LOCK:
+        listos = {periodo: batch for periodo, batch in _PENDING_INDEX.items() if batch.proximo_intento <= ahora}
+        for periodo in listos:
+            del _PENDING_INDEX[periodo]
+        _FLUSHING_INDEX.update(listos)
+
+    for periodo_str, batch in listos.items():
+        try:
+            _save_index_batch(periodo_str, batch)
+        except Exception as e:
+            batch.intentos += 1
+            with _PENDING_INDEX_LOCK:
+                _FLUSHING_INDEX.pop(periodo_str, None)
+                descartar = batch.intentos >= _INDEX_MAX_ATTEMPTS
+                if not descartar:
+                    nuevo = _PENDING_INDEX.get(periodo_str)
+                    if nuevo is not None:
+                        for future, (cuils, lider) in nuevo.subidas.items():
+                            batch.agregar(future, cuils, lider)
+                    espera = min(_INDEX_FLUSH_SECONDS * 2 ** batch.intentos, _INDEX_RETRY_MAX_SECONDS)
+                    batch.proximo_intento = time.monotonic() + espera
+                    _PENDING_INDEX[periodo_str] = batch
+            if descartar:
+                logger.error("No se pudo actualizar el índice del período %s después de %d intentos: %s", periodo_str, batch.intentos, e)
+                for waiter in batch.subidas:
+                    waiter.set_exception(e)
             else:
-                to_add.append({"Periodo": periodo_str, "CUIL": c, "Lider": leader_name})
+                logger.warning("Error al actualizar el índice del período %s (intento %d): %s", periodo_str, batch.intentos, e)
+            continue
+
+        with _PENDING_INDEX_LOCK:
+            _FLUSHING_INDEX.pop(periodo_str, None)
+        for waiter in batch.subidas:
+            waiter.set_result(None)
+
+def _index_flush_loop():
+    while True:
+        time.sleep(_INDEX_FLUSH_SECONDS)
+        _flush_pending_index()
+
+def _ensure_index_flusher():
+    """Arranca (una sola vez por proceso) el hilo que guarda el índice."""
+    global _index_flusher
+    with _PENDING_INDEX_LOCK:
+        if _index_flusher is None or not _index_flusher.is_alive():
+            _index_flusher = threading.Thread(target=_index_flush_loop, name="index-flush", daemon=True)
+            _index_flusher.start()
+
+# Función para calcular la huella del contenido del Excel
+def _content_digest(file_bytes, original_filename):
+    """
+    Huella corta (blake2b, 16 caracteres hex) del contenido y del nombre del archivo,
+    para detectar re-subidas. El nombre entra en la huella porque de él salen el
+    líder, la sucursal y la fecha: renombrar el mismo Excel es otra carga.
+    """
+    h = hashlib.blake2b(file_bytes, digest_size=8)
+    h.update(original_filename.encode("utf-8"))
+    return h.hexdigest()
 
-        if to_add:
-            df = pd.concat([df, pd.DataFrame(to_add)], ignore_index=True)
+# Función para verificar si un contenido ya se subió en el período
+def _get_digest_marker_key(periodo_str, digest):
+    """Key de la marca de un tablero ya subido. Ejemplo: '01-10-2025/_digests/<huella>'"""
+    return f"{periodo_str}/_digests/{digest}"
 
-        _save_period_index(df, periodo_str)
-    except Exception as e:
-        st.error(f"Error al actualizar el índice del período: {e}")
+def _already_uploaded(periodo_str, digest):
+    """
+    True si en el período ya se subió un tablero con la misma huella
+    (existe su marca '<Periodo>/_digests/<huella>', ver _mark_uploaded).
+    Ante cualquier otro error se responde False: la consulta no debe impedir la carga.
+    """
+    try:
+        s3.head_object(Bucket=bucket_name, Key=_get_digest_marker_key(periodo_str, digest))
+        return True
+    except ClientError as e:
+        code = e.response.get("Error", {}).get("Code")
+        if code not in ("NoSuchKey", "404", "NotFound"):
+            logger.warning("No se pudo consultar la huella %s del período %s", digest, periodo_str, exc_info=True)
+        return False
+    except Exception:
+        logger.warning("No se pudo consultar la huella %s del período %s", digest, periodo_str, exc_info=True)
+        return False
+
+# Función para registrar la huella de un tablero ya subido
+def _mark_uploaded(periodo_str, digest):
+    """Escribe la marca vacía que busca _already_uploaded; si falla, solo se registra en el log."""
+    try:
+        s3.put_object(Bucket=bucket_name, Key=_get_digest_marker_key(periodo_str, digest), Body=b"")
+    except Exception:
+        logger.warning("No se pudo guardar la huella %s del período %s", digest, periodo_str, exc_info=True)
+
+# Avisos durante la lectura del Excel (ver _parse_tablero)
+# (desde un hilo del pool van al _SheetReport de la hoja)
+def _parse_warning(message):
+    report = _current_sheet_report()
+    if report is not None:
+        report.warnings.append(message)
+    else:
+        st.session_state["_parse_notices"]["warnings"].append(message)
+
+def _parse_log(message, filename):
+    report = _current_sheet_report()
+    if report is not None:
+        report.logs.append((message, filename))
+    else:
+        st.session_state["_parse_notices"]["logs"].append((message, filename))
+
+def _emit_parse_notices(notices):
+    """Muestra los avisos y registra los logs juntados durante la lectura del Excel."""
+    for message in notices["warnings"]:
+        st.warning(message)
+    for message, filename in notices["logs"]:
+        log_error_to_s3(message, filename)
+
+class _TableroInvalido(Exception):
+    """El Excel no pasó las validaciones; los errores ya se reportaron."""
+
+# Función para leer y validar el Excel, cacheada por contenido del archivo
+@st.cache_data(show_spinner=False, ttl=3600, max_entries=16)
+def _parse_tablero(file_bytes, original_filename):
+    """
+    Lee y valida todas las hojas del Excel y devuelve el DataFrame limpio.
+    El resultado queda en cache por (bytes, nombre del archivo): las re-ejecuciones
+    del script (por ejemplo al confirmar un ajuste) no vuelven a parsearlo.
+    Si el archivo no es válido lanza _TableroInvalido, así no queda nada en cache.
+    Devuelve (DataFrame, avisos): st.cache_data no repite los st.warning ni los
+    registros de log hechos adentro, así que se devuelven para emitirlos en cada
+    ejecución con _emit_parse_notices.
+    """
+    now = datetime.now(ARGENTINA_TZ)
+    st.session_state["_parse_notices"] = {"warnings": [], "logs": []}
+    workbook = _open_workbook(file_bytes)
+    try:
+        cleaned_df, success = process_sheets_until_empty(workbook, original_filename, now)
+    finally:
+        workbook.close()
+        notices = st.session_state.pop("_parse_notices")
+    if not success:
+        _emit_parse_notices(notices)
+        raise _TableroInvalido()
+    return cleaned_df, notices
 
 # Función para procesar y subir el Excel
 def process_and_upload_excel(file, original_filename):
+    st.session_state["_error_messages"] = []
+    st.session_state["_error_log"] = []
     try:
         if not validate_filename(original_filename):
             error_message = "El nombre del archivo no cumple con el formato requerido (dd-mm-aaaa+empresa+nombre lider.xlsx)."
-            st.error(error_message)
-            log_error_to_s3(error_message, original_filename)
+            _report_error(error_message, original_filename)
             return
 
         if not validate_file_date(original_filename):
             error_message = "La fecha del nombre del archivo solo puede ser de un mes anterior, o de dos meses atrás (hasta el día 10)."
-            st.error(error_message)
-            log_error_to_s3(error_message, original_filename)
+            _report_error(error_message, original_filename)
             return
 
-        excel_data = pd.ExcelFile(file)
-        argentina_tz = pytz.timezone("America/Argentina/Buenos_Aires")
-        now = datetime.now(argentina_tz)
-        upload_datetime = now.strftime('%d/%m/%Y_%H:%M:%S')
-        cleaned_df, success = process_sheets_until_empty(excel_data, original_filename, upload_datetime)
+        fecha_archivo = original_filename.split('+')[0]                # ej: '03-04-2025'
+        periodo_str = normalize_fecha_to_first_day(fecha_archivo)      # ej: '01-04-2025'
+
+        # Si este mismo contenido ya se subió en el período, no se vuelve a procesar
+        file_bytes = file.getvalue()
+        digest = _content_digest(file_bytes, original_filename)
+        if _already_uploaded(periodo_str, digest):
+            st.info(f"El archivo '{original_filename}' ya fue subido en este período; no se vuelve a cargar.")
+            return
 
-        if not success:
+        now = datetime.now(ARGENTINA_TZ)
+        try:
+            cleaned_df, notices = _parse_tablero(file_bytes, original_filename)
+        except _TableroInvalido:
             error_message = "El archivo contiene errores en su estructura y no se cargará"
-            st.error(error_message)
-            log_error_to_s3(error_message, original_filename)
+            _report_error(error_message, original_filename)
             return
+        _emit_parse_notices(notices)
+        # La hora de subida es la de esta ejecución, no la del parseo que quedó en cache
+        cleaned_df['Fecha Horario Subida'] = now.strftime('%d/%m/%Y_%H:%M:%S')
 
         if cleaned_df.empty:
             error_message = "El archivo no tiene datos válidos después de la limpieza."
-            st.error(error_message)
-            log_error_to_s3(error_message, original_filename)
+            _report_error(error_message, original_filename)
             return
 
         # ===== CUILs únicos del archivo =====
-        unique_cuils = cleaned_df['CUIL'].astype(str).unique().tolist()
-        fecha_archivo = original_filename.split('+')[0]                # ej: '03-04-2025'
-        periodo_str = normalize_fecha_to_first_day(fecha_archivo)      # ej: '01-04-2025'
+        # CUIL es category y recién convertido: sus categorías son exactamente los CUILs del archivo.
+        # Un mismo CUIL puede venir como número y como texto (dos categorías), por eso se
+        # deduplica después de pasarlo a str (se pasa el ndarray tal cual: los consumidores solo lo recorren)
+        unique_cuils = pd.unique(cleaned_df['CUIL'].cat.categories.astype(str).to_numpy())
         leader_name = cleaned_df['Nombre Lider'].iloc[0]
 
         # Verificar duplicados usando ÍNDICE DEL PERÍODO para TODOS los CUILs
@@ -787,52 +1585,51 @@ def process_and_upload_excel(file, original_filename):
                 "No se puede subir el archivo porque existen CUILs ya cargados por otro líder en el período:\n"
                 f"{conflictos_txt}"
             )
-            st.error(error_message)
-            log_error_to_s3(error_message, original_filename)
+            _report_error(error_message, original_filename)
             return
 
         # Contar CUILs únicos (tableros)
         unique_cuils_count = len(unique_cuils)
         st.info(f"Se subieron {unique_cuils_count} tableros.")
 
-        upload_datetime_obj = datetime.strptime(upload_datetime, '%d/%m/%Y_%H:%M:%S')
-        tablero_type = determine_tablero_type(fecha_archivo, upload_datetime_obj)
+        tablero_type = determine_tablero_type(fecha_archivo, now)
         ajuste_value = "SI" if tablero_type == "Ajuste" else "NO"
         cleaned_df["Ajuste"] = ajuste_value
 
         if tablero_type == "Ajuste":
             st.warning("El tablero se va a cargar como ajuste, ¿desea guardarlo igualmente?")
-            guardar = st.button("Guardar")
-            cancelar = st.button("Cancelar")
+            # En un form, la decisión llega en un solo envío (una sola re-ejecución del script)
+            with st.form("confirmar_ajuste"):
+                guardar = st.form_submit_button("Guardar")
+                cancelar = st.form_submit_button("Cancelar")
             if cancelar:
                 st.info("El archivo no se guardó.")
                 return
             if not guardar:
                 return
 
-        # Armado ruta destino del CSV limpio
+        # Armado ruta destino del tablero limpio
         fecha_carpeta = periodo_str  # ya normalizada a '01-mm-aaaa'
-        csv_filename = f"{fecha_carpeta}/{now.strftime('%Y-%m-%d_%H-%M-%S')}_{original_filename.split('.')[0]}.csv"
-
-        # Subir CSV limpio a S3
-        csv_buffer = BytesIO()
-        cleaned_df.to_csv(csv_buffer, index=False, encoding="utf-8-sig")
-        csv_buffer.seek(0)
-        ok = upload_file_to_s3(csv_buffer, csv_filename, original_filename)
-        if not ok:
-            # Si falló la subida del CSV, no toco el índice
-            return
+        marca_hora = f"{now.year:04d}-{now.month:02d}-{now.day:02d}_{now.hour:02d}-{now.minute:02d}-{now.second:02d}"
+        archive_filename = f"{fecha_carpeta}/{marca_hora}_{original_filename.split('.')[0]}.{_ARCHIVE_EXTENSIONS[ARCHIVE_FORMAT]}"
 
-        # ✅ Actualizar índice del período con TODOS los CUILs subidos
-        _update_period_index_with_upload(periodo_str, unique_cuils, leader_name)
+        # Subir tablero limpio a S3 y actualizar el índice; recién entonces se marca la huella
+        if _upload_tablero(cleaned_df, archive_filename, original_filename, periodo_str, unique_cuils, leader_name):
+            _mark_uploaded(periodo_str, digest)
 
     except Exception as e:
         error_message = f"Error al procesar el archivo Excel: {e}"
-        st.error(error_message)
-        log_error_to_s3(error_message, original_filename)
+        _report_error(error_message, original_filename)
+    finally:
+        _render_errors()
+        _flush_error_log()
 
+@lru_cache(maxsize=4096)
 def normalize_fecha_to_first_day(fecha_str):
     """Convierte cualquier fecha dd-mm-aaaa a 01-mm-aaaa"""
+    # Camino rápido: fechas que seguro son válidas (día <= 28) se resuelven sin strptime
+    if _DDMMYYYY_RE.fullmatch(fecha_str):
+        return "01-" + fecha_str[3:]
     try:
         dt = datetime.strptime(fecha_str, "%d-%m-%Y")
         return dt.replace(day=1).strftime("%d-%m-%Y")